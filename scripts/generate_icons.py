@@ -1,42 +1,108 @@
 
 import argparse
+import functools
 import os
-from PIL import Image, ImageChops, ImageFilter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+# 依赖: pip install numpy pillow
+# 可用 pillow-simd 替换 pillow（同样的 `from PIL import Image` API），LANCZOS 缩放可走 SSE4/AVX2 加速：
+#   pip uninstall pillow && CC="cc -mavx2" pip install -U --force-reinstall pillow-simd
+from PIL import Image
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DEFAULT_RESOURCES_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, "..", "resources"))
+# 输出图标的最大边长（icon.png / ICNS 512）
+MAX_ICON_SIZE = 512
+# 托盘图标的最大边长，以及托盘共用底图预缩放到该尺寸的倍数
+MAX_TRAY_SIZE = 32
+TRAY_PRESCALE = 4
 LEGACY_SOURCE_IMAGE_PATH = r"C:/Users/Administrator/.gemini/antigravity/brain/d9fce87b-7355-4ee5-a487-4f6c2c186145/ag_simple_capsule_1767751839629.png"
 
-def remove_white_background(img, threshold=240):
+@functools.lru_cache(maxsize=None)
+def _load_strip_kernel():
+    """
+    可选依赖：通过 --use-numba 显式启用 JIT 编译的并行背景移除内核。
+    单次运行只处理一张图，导入 numba 和加载内核（约 0.5 s）远比 NumPy 路径慢，因此默认不启用；
+    适合在同一进程中批量处理多张图或多个阈值时使用。未安装 numba 时返回 None。
+    """
+    try:
+        from numba import njit, prange
+    except ImportError:
+        return None
+
+    @njit(parallel=True, cache=True)
+    def strip_white_background(arr, threshold):
+        for i in prange(arr.shape[0]):
+            for j in range(arr.shape[1]):
+                if arr[i, j, 0] > threshold and arr[i, j, 1] > threshold and arr[i, j, 2] > threshold:
+                    arr[i, j, 0] = 255
+                    arr[i, j, 1] = 255
+                    arr[i, j, 2] = 255
+                    arr[i, j, 3] = 0
+
+    return strip_white_background
+
+def remove_white_background(img, threshold=240, use_numba=False):
     """
     将白色/近白色背景转换为透明。
     threshold: RGB 值高于此阈值的像素被视为"白色"并设为透明。
+    use_numba: 为 True 且已安装 numba 时改用 JIT 内核，否则使用 NumPy。
+    返回 (图像, alpha 通道数组)，后续裁剪可直接复用 alpha，无需再 split()。
     """
-    img = img.convert('RGBA')
-    data = img.getdata()
-    
-    new_data = []
-    for item in data:
-        # 如果 R, G, B 都接近白色（高于阈值），则设为透明
-        if item[0] > threshold and item[1] > threshold and item[2] > threshold:
-            new_data.append((255, 255, 255, 0))  # 完全透明
-        else:
-            new_data.append(item)
-    
-    img.putdata(new_data)
-    return img
-
-def crop_to_alpha_bbox(img: Image.Image, alpha_threshold: int = 0) -> Image.Image:
-    img = img.convert("RGBA")
-    alpha = img.split()[-1]
-    if alpha_threshold > 0:
-        alpha = alpha.point(lambda p: 255 if p > alpha_threshold else 0)
-    bbox = alpha.getbbox()
-    return img.crop(bbox) if bbox else img
-
-def render_tray_icon(img: Image.Image, size: int, stroke_px: int, stroke_opacity: float = 0.85) -> Image.Image:
-    base = crop_to_alpha_bbox(img)
-    w, h = base.size
+    if img.mode != 'RGBA':
+        img = img.convert('RGBA')
+    arr = np.array(img)
+    strip_kernel = _load_strip_kernel() if use_numba else None
+    if strip_kernel is not None:
+        strip_kernel(arr, threshold)
+        return Image.fromarray(arr), arr[..., 3]
+
+    # 如果 R, G, B 都接近白色（高于阈值），则设为透明：三个通道逐元素取最小值后与阈值比较
+    # （沿长度为 3 的步长轴做 min() 归约在 NumPy 里很慢，这里用两次 np.minimum）
+    mask = np.minimum(np.minimum(arr[..., 0], arr[..., 1]), arr[..., 2]) > threshold
+    # 按 uint32 视图整像素写入，用本机字节序打包 (255, 255, 255, 0)，即完全透明的白色
+    packed = arr.view(np.uint32).reshape(arr.shape[:2])
+    packed[mask] = np.array([255, 255, 255, 0], dtype=np.uint8).view(np.uint32)[0]
+    return Image.fromarray(arr), arr[..., 3]
+
+def crop_to_alpha_bbox(img: Image.Image, alpha_threshold: int = 0, alpha: np.ndarray | None = None) -> Image.Image:
+    """
+    alpha: 可传入已有的 alpha 通道数组（如 remove_white_background 的返回值），省去再次取通道。
+    """
+    if alpha is None:
+        alpha = np.asarray(img.getchannel("A"))
+    mask = alpha > alpha_threshold
+    ys = np.flatnonzero(mask.any(axis=1))
+    xs = np.flatnonzero(mask.any(axis=0))
+    if ys.size == 0:
+        return img
+    return img.crop((int(xs[0]), int(ys[0]), int(xs[-1]) + 1, int(ys[-1]) + 1))
+
+def dilate_alpha(alpha: np.ndarray, radius: int) -> np.ndarray:
+    """
+    对 alpha 通道做 (2*radius+1) 方形窗口的最大值膨胀，等价于 ImageFilter.MaxFilter。
+    拆成水平、垂直两次一维最大值，每像素比较次数由 k² 降为 2k；边缘按复制像素处理。
+    """
+    if radius <= 0:
+        return alpha.copy()
+    padded = np.pad(alpha, radius, mode="edge")
+    h, w = alpha.shape
+    k = radius * 2 + 1
+    rows = padded[:, :w].copy()
+    for dx in range(1, k):
+        np.maximum(rows, padded[:, dx:dx + w], out=rows)
+    out = rows[:h].copy()
+    for dy in range(1, k):
+        np.maximum(out, rows[dy:dy + h], out=out)
+    return out
+
+def render_tray_icon(base: Image.Image, size: int, stroke_px: int, stroke_opacity: float = 0.85,
+                     source_size: tuple[int, int] | None = None) -> Image.Image:
+    """
+    base: 已经过 crop_to_alpha_bbox 裁剪的 RGBA 图像，多个尺寸可共用同一份。
+    source_size: base 经过预缩放时传入预缩放前的尺寸，按原始宽高比计算目标尺寸，避免两次取整带来的偏差。
+    """
+    w, h = source_size or base.size
     scale = min(size / w, size / h)
     nw = max(1, int(round(w * scale)))
     nh = max(1, int(round(h * scale)))
@@ -45,15 +111,13 @@ def render_tray_icon(img: Image.Image, size: int, stroke_px: int, stroke_opacity
     canvas = Image.new("RGBA", (size, size), (0, 0, 0, 0))
     canvas.paste(base, ((size - nw) // 2, (size - nh) // 2), base)
 
-    alpha = canvas.split()[-1]
-    kernel = stroke_px * 2 + 1
-    dilated = alpha.filter(ImageFilter.MaxFilter(kernel))
-    border = ImageChops.subtract(dilated, alpha)
-    if stroke_opacity < 1:
-        border = border.point(lambda p: int(p * stroke_opacity))
+    alpha = np.asarray(canvas)[..., 3]
+    # 描边 = (膨胀 alpha - 原 alpha) * 不透明度，一次查表完成；膨胀结果逐像素 >= 原 alpha，相减不会下溢
+    opacity_lut = (np.arange(256) * min(stroke_opacity, 1.0)).astype(np.uint8)
+    border = opacity_lut[dilate_alpha(alpha, stroke_px) - alpha]
 
     stroke = Image.new("RGBA", (size, size), (0, 0, 0, 255))
-    stroke.putalpha(border)
+    stroke.putalpha(Image.fromarray(border))
     return Image.alpha_composite(stroke, canvas)
 
 def resolve_source_image_path(cli_source: str | None, resources_dir: str) -> str | None:
@@ -68,56 +132,106 @@ def resolve_source_image_path(cli_source: str | None, resources_dir: str) -> str
             return candidate
     return None
 
-def generate_icons(source_image_path: str, resources_dir: str, only_tray: bool) -> None:
+def generate_icons(source_image_path: str, resources_dir: str, only_tray: bool, assume_transparent: bool = False,
+                   use_numba: bool = False) -> None:
     if not os.path.exists(resources_dir):
         os.makedirs(resources_dir)
         print(f"Created directory: {resources_dir}")
 
     try:
         img = Image.open(source_image_path)
+        # JPEG 源图让 libjpeg 直接按 1/2、1/4、1/8 缩小解码，只保留不小于最大输出尺寸的分辨率
+        if img.format == 'JPEG':
+            img.draft('RGB', (MAX_ICON_SIZE, MAX_ICON_SIZE))
         print(f"Loaded image: {img.size} {img.format} {img.mode}")
 
         # Ensure RGBA
         if img.mode != 'RGBA':
             img = img.convert('RGBA')
         
-        # 移除白色背景（使其透明）
-        img = remove_white_background(img)
-        print("Removed white background (converted to transparent)")
+        # 移除白色背景（使其透明）；源图已带透明通道时跳过
+        alpha = np.asarray(img.getchannel("A"))
+        if assume_transparent:
+            print("--assume-transparent given, skipped white background removal")
+        elif alpha.min() < 255:
+            print("Source already has transparency, skipped white background removal")
+        else:
+            if use_numba and _load_strip_kernel() is None:
+                print("numba is not installed, falling back to NumPy for white background removal")
+            img, alpha = remove_white_background(img, use_numba=use_numba)
+            print("Removed white background (converted to transparent)")
 
         if not only_tray:
             # 1. Generate icon.ico for Windows
             # Sizes recommended for Windows
             icon_sizes = [(256, 256), (128, 128), (64, 64), (48, 48), (32, 32), (16, 16)]
+            icns_sizes = [(512, 512), (256, 256), (128, 128), (64, 64), (32, 32)]
+            # ICO 帧按 ICO 编码器的方式生成：thumbnail 保持宽高比，跳过大于源图的尺寸；
+            # 预先生成后编码器直接按尺寸取用，不再内部缩放
+            ico_sizes = [s for s in icon_sizes if s[0] <= img.width and s[1] <= img.height]
+
+            def make_ico_frame(size):
+                frame = img.copy()
+                frame.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=None)
+                return frame
+
+            # icon.png 与 ICNS 需要正方形图像，每个尺寸只用 LANCZOS 缩放一次，两者共用缓存结果
+            square_sizes = sorted(set(icns_sizes) | {(MAX_ICON_SIZE, MAX_ICON_SIZE)}, reverse=True)
+            # Pillow 的 resize 在 C 层释放 GIL，多线程可并行各尺寸的缩放
+            with ThreadPoolExecutor() as pool:
+                ico_frames = pool.map(make_ico_frame, ico_sizes)
+                resized = dict(zip(square_sizes, pool.map(lambda s: img.resize(s, Image.Resampling.LANCZOS), square_sizes)))
+                ico_frames = list(ico_frames)
+
             ico_path = os.path.join(resources_dir, "icon.ico")
-            img.save(ico_path, format='ICO', sizes=icon_sizes)
+            if ico_frames:
+                ico_frames[0].save(ico_path, format='ICO', sizes=[f.size for f in ico_frames], append_images=ico_frames[1:])
+            else:
+                # 源图小于所有 ICO 尺寸，交给编码器按原逻辑处理（跳过超出源图的尺寸），不影响其余输出
+                img.save(ico_path, format='ICO', sizes=icon_sizes)
             print(f"Generated: {ico_path}")
 
             # 2. Generate icon.png (High Res)
             png_path = os.path.join(resources_dir, "icon.png")
-            img.resize((512, 512), Image.Resampling.LANCZOS).save(png_path, format='PNG')
+            resized[(MAX_ICON_SIZE, MAX_ICON_SIZE)].save(png_path, format='PNG', optimize=False, compress_level=1)
             print(f"Generated: {png_path}")
 
         # 3. Generate tray icons (Small PNGs)
         # Usually tray icons are 16x16 or 32x32 (for high DPI)
+        tray_base = crop_to_alpha_bbox(img, alpha=alpha)
+        tray_source_size = tray_base.size
+        # 裁剪后的底图远大于托盘尺寸时，先缩到最大托盘尺寸的 TRAY_PRESCALE 倍，
+        # 各尺寸的 LANCZOS 缩放便不必再从全分辨率图像开始
+        prescale_size = MAX_TRAY_SIZE * TRAY_PRESCALE
+        w, h = tray_base.size
+        if max(w, h) > prescale_size * 2:
+            scale = prescale_size / max(w, h)
+            tray_base = tray_base.resize(
+                (max(1, int(round(w * scale))), max(1, int(round(h * scale)))),
+                Image.Resampling.LANCZOS,
+            )
         tray_16 = os.path.join(resources_dir, "tray-16x16.png")
-        render_tray_icon(img, 16, stroke_px=1).save(tray_16, format='PNG')
+        render_tray_icon(tray_base, 16, stroke_px=1, source_size=tray_source_size).save(tray_16, format='PNG', optimize=False, compress_level=1)
         
         tray_32 = os.path.join(resources_dir, "tray-32x32.png")
-        render_tray_icon(img, 32, stroke_px=2).save(tray_32, format='PNG')
+        render_tray_icon(tray_base, MAX_TRAY_SIZE, stroke_px=2, source_size=tray_source_size).save(tray_32, format='PNG', optimize=False, compress_level=1)
         print(f"Generated tray icons: {tray_16}, {tray_32}")
         
         if not only_tray:
             # 4. Attempt to generate icon.icns (Mac) - Optional/Partial
-            # Since we are on Windows, we'll try to save as ICNS if Pillow supports it,
-            # otherwise we might just leave it or creating a PNG named .icns is bad practice.
-            # Let's check if we can save as ICNS.
+            # Only attempt it when this Pillow build registers an ICNS writer
+            # (older Pillow versions only register it on macOS), instead of
+            # running the encoder just to catch the failure.
             icns_path = os.path.join(resources_dir, "icon.icns")
-            try:
-                img.save(icns_path, format='ICNS', sizes=[(512,512), (256,256), (128,128), (32,32), (16,16)])
-                print(f"Generated: {icns_path}")
-            except Exception as e:
-                print(f"Could not generate ICNS (expected on Windows without heavy libs): {e}")
+            Image.init()
+            if 'ICNS' not in Image.SAVE:
+                print("Skipped ICNS: this Pillow build cannot write ICNS on this platform")
+            else:
+                try:
+                    img.save(icns_path, format='ICNS', append_images=[resized[s] for s in icns_sizes])
+                    print(f"Generated: {icns_path}")
+                except Exception as e:
+                    print(f"Could not generate ICNS: {e}")
 
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -127,6 +241,8 @@ if __name__ == "__main__":
     parser.add_argument("--source", help="Source image path (PNG recommended).")
     parser.add_argument("--resources-dir", default=DEFAULT_RESOURCES_DIR, help="Output resources directory.")
     parser.add_argument("--only-tray", action="store_true", help="Only generate tray icons (does not overwrite icon.ico/icon.png/icon.icns).")
+    parser.add_argument("--assume-transparent", action="store_true", help="Skip white background removal (source already has a transparent background).")
+    parser.add_argument("--use-numba", action="store_true", help="Use the numba JIT kernel for white background removal (requires numba; slower for a single image due to import/JIT startup).")
     args = parser.parse_args()
 
     source_image_path = resolve_source_image_path(args.source, args.resources_dir)
@@ -136,4 +252,4 @@ if __name__ == "__main__":
             f"or place an icon at {os.path.join(args.resources_dir, 'icon.png')}"
         )
 
-    generate_icons(source_image_path, args.resources_dir, args.only_tray)
+    generate_icons(source_image_path, args.resources_dir, args.only_tray, args.assume_transparent, args.use_numba)